@@ -1,12 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import hashlib
 import importlib.resources as imres
+from itertools import repeat
+import os
+import threading
+from xml.sax.saxutils import escape, quoteattr
+import zipfile
 
 import attr
 from ebooklib import epub
 import importlib_resources as imres
+from lxml import etree, html
 from . import utils
 
 from .model import Image
 
+console = utils.getConsole()
+
 
 @attr.s
 class BookDetails:
@@ -33,6 +44,9 @@ class CollectionMetadata:
     position = attr.ib()
 
 
+# set to any value to generate the EPUB with ebooklib (previous implementation)
+EBOOKLIB_WRITER_ENVVAR = "JNCEP_EBOOKLIB_WRITER"
+
 DEFAULT_STYLE_CSS_PATH = "res/style.css"
 CACHED_STYLE_CSS = None
 
@@ -57,11 +71,324 @@ def get_css(style_css_path):
     return CACHED_STYLE_CSS
 
 
-def output_epub(output_filepath, book_details: BookDetails, style_css_path=None):
-    with open("output.txt", "w", encoding="utf-8") as file:
-        file.write(str(book_details.contents))
-    #print(book_details)
-    lang = "en"
+def output_epub(output, book_details: BookDetails, style_css_path=None):
+    # output: file path or writable binary file object (eg BytesIO to keep the
+    # EPUB in memory)
+    # book_details is not modified so can be output multiple times
+    new_contents, titles_list = utils.split_by_chapter(book_details.contents)
+
+    style = get_css(style_css_path)
+
+    if os.environ.get(EBOOKLIB_WRITER_ENVVAR):
+        _output_epub_ebooklib(output, book_details, style, new_contents, titles_list)
+    else:
+        _output_epub_zip(output, book_details, style, new_contents, titles_list)
+
+
+LANG = "en"
+# same layout as the EPUB generated by ebooklib
+EPUB_FOLDER = "EPUB"
+STYLE_CSS_FILENAME = "book.css"
+
+CONTAINER_XML = f"""<?xml version="1.0" encoding="utf-8"?>
+<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container" version="1.0">
+  <rootfiles>
+    <rootfile media-type="application/oebps-package+xml" \
+full-path="{EPUB_FOLDER}/content.opf"/>
+  </rootfiles>
+</container>
+"""
+
+# the stylesheet is the same for all the documents so linked in the template
+# bytes: the documents are assembled without going through a str
+XHTML_PREFIX = f"""<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" \
+lang="{LANG}" xml:lang="{LANG}">
+<head>
+<title>%s</title>
+<link href="{STYLE_CSS_FILENAME}" rel="stylesheet" type="text/css"/>
+</head>
+<body>""".encode()
+XHTML_SUFFIX = b"""</body>
+</html>
+"""
+
+# lxml parsers cannot be used concurrently: one per thread
+_thread_local = threading.local()
+
+
+def _output_epub_zip(output, book_details, style, contents, titles):
+    # the zip is written directly in a single pass, without the in-memory EPUB
+    # model of ebooklib: each entry is written then released
+    if book_details.cover_image:
+        cover_content = book_details.cover_image.content
+        # in case cover image also present in content, use the file name
+        # (same URL => same local filename or cover.jpg (renamed in core.py))
+        cover_image_filename = book_details.cover_image.local_filename
+    else:
+        # may look broken in epub reader
+        # TODO handle problem with missing cover => use dummy jpeg
+        cover_content = b""
+        # dummy file name
+        cover_image_filename = "cover.jpg"
+
+    # do not add if already added through cover or problems when writing:
+    # "Duplicate name" warning from zipfile + maybe issue in the epub zip structure
+    images = [
+        image
+        for image in book_details.images
+        if image.local_filename != cover_image_filename
+    ]
+    images, filename_aliases = _dedup_images(
+        images, cover_image_filename, cover_content
+    )
+    chapter_filenames = [f"chap_{i}.xhtml" for i in range(len(contents))]
+
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zf:
+
+        def write(filename, data, compress_type=None):
+            zf.writestr(f"{EPUB_FOLDER}/{filename}", data, compress_type)
+
+        # must be first and uncompressed
+        zf.writestr(
+            "mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED
+        )
+        zf.writestr("META-INF/container.xml", CONTAINER_XML)
+
+        write(
+            "content.opf",
+            _opf(book_details, cover_image_filename, images, chapter_filenames),
+        )
+        write("toc.ncx", _ncx(book_details, titles, chapter_filenames))
+        write("nav.xhtml", _nav(book_details, titles, chapter_filenames))
+        write(STYLE_CSS_FILENAME, style)
+
+        # JPEG is already compressed: deflate would only cost CPU time
+        write(cover_image_filename, cover_content, zipfile.ZIP_STORED)
+        cover_body = f'<img src={quoteattr(cover_image_filename)} alt="cover"/>'
+        write("cover.xhtml", _xhtml("Cover", cover_body.encode("utf-8")))
+
+        image: Image
+        for image in images:
+            write(image.local_filename, image.content, zipfile.ZIP_STORED)
+
+        # lxml releases the GIL while parsing and serializing so the chapters can
+        # be converted in parallel ; zipfile is not thread-safe so written here
+        with ThreadPoolExecutor() as executor:
+            chapters = executor.map(
+                _chapter_xhtml, titles, contents, repeat(filename_aliases)
+            )
+            for filename, chapter in zip(chapter_filenames, chapters):
+                write(filename, chapter)
+
+
+def _dedup_images(images, cover_image_filename, cover_content):
+    # the same illustration can be present with different URLs (so different local
+    # filenames) or in multiple parts: only add its content once to the EPUB
+    unique_images = []
+    # local filename => local filename of the image with the same content
+    filename_aliases = {}
+    filenames = {cover_image_filename}
+    seen = {}
+    if cover_content:
+        seen[_content_digest(cover_content)] = cover_image_filename
+
+    for image in images:
+        digest = _content_digest(image.content)
+        canonical_filename = seen.get(digest)
+        if canonical_filename is None:
+            if image.local_filename in filenames:
+                # would be a duplicate name in the zip
+                console.warning(
+                    f"Image '{image.url}' not added to the EPUB: different content "
+                    f"but same file name '{image.local_filename}' as another image"
+                )
+                continue
+            seen[digest] = image.local_filename
+            filenames.add(image.local_filename)
+            unique_images.append(image)
+        elif canonical_filename != image.local_filename:
+            filename_aliases[image.local_filename] = canonical_filename
+
+    return unique_images, filename_aliases
+
+
+def _content_digest(content):
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+
+def _chapter_xhtml(title, content, filename_aliases):
+    body = _body_content(_to_utf8(content), filename_aliases)
+    return _xhtml(title, body)
+
+
+def _to_utf8(content):
+    # explicit encoding to bytes or some issue with lxml on some platforms
+    # (PyDroid) some message about USC4 little endian not supported
+    return content.encode("utf-8")
+
+
+def _xhtml(title, body):
+    return b"".join([XHTML_PREFIX % escape(title).encode("utf-8"), body, XHTML_SUFFIX])
+
+
+def _html_parser():
+    parser = getattr(_thread_local, "html_parser", None)
+    if parser is None:
+        parser = html.HTMLParser(encoding="utf-8")
+        _thread_local.html_parser = parser
+    return parser
+
+
+def _body_content(content, filename_aliases):
+    # the content is a full HTML document: keep the children of body only and
+    # serialize them as XML (so valid XHTML)
+    html_tree = html.document_fromstring(content, parser=_html_parser())
+    body = html_tree.find("body")
+    if body is None:
+        return b""
+
+    if filename_aliases:
+        # point to the image kept in the EPUB when removed as a duplicate
+        for img in body.iter("img"):
+            src = (img.get("src") or "").strip()
+            if src in filename_aliases:
+                img.set("src", filename_aliases[src])
+
+    body_content = [escape(body.text or "").encode("utf-8")]
+    for child in body:
+        # tail included
+        body_content.append(etree.tostring(child, encoding="utf-8"))
+    return b"".join(body_content)
+
+
+def _opf(book_details: BookDetails, cover_image_filename, images, chapter_filenames):
+    collection_meta = book_details.collection
+    collection_id = quoteattr(collection_meta.collection_id)
+    collection_ref = quoteattr(f"#{collection_meta.collection_id}")
+
+    subjects = ["Light Novel"]
+    if not book_details.complete:
+        subjects.append("partial")
+    subjects.extend(book_details.tags)
+
+    modified = datetime.now(tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    metadata = [
+        f'<meta property="dcterms:modified">{modified}</meta>',
+        f'<dc:identifier id="id">{escape(book_details.identifier)}</dc:identifier>',
+        f"<dc:title>{escape(book_details.title)}</dc:title>",
+        f"<dc:language>{LANG}</dc:language>",
+        f'<dc:creator id="creator">{escape(book_details.author)}</dc:creator>',
+        f"<dc:description>{escape(book_details.description or '')}</dc:description>",
+        "<dc:publisher>J-Novel Club (generated)</dc:publisher>",
+        *[f"<dc:subject>{escape(subject)}</dc:subject>" for subject in subjects],
+        # metadata for series GH issue #9
+        f'<meta property="belongs-to-collection" id={collection_id}>'
+        f"{escape(collection_meta.collection_title)}</meta>",
+        f'<meta property="collection-type" refines={collection_ref}>series</meta>',
+        f'<meta property="group-position" refines={collection_ref}>'
+        f"{collection_meta.position}</meta>",
+        '<meta name="cover" content="cover-img"/>',
+    ]
+
+    manifest = [
+        f'<item href={quoteattr(cover_image_filename)} id="cover-img" '
+        'media-type="image/jpeg" properties="cover-image"/>',
+        f'<item href="{STYLE_CSS_FILENAME}" id="style" media-type="text/css"/>',
+        '<item href="cover.xhtml" id="cover" media-type="application/xhtml+xml"/>',
+    ]
+    for i, image in enumerate(images):
+        # TODO always ? check ?
+        manifest.append(
+            f'<item href={quoteattr(image.local_filename)} id="image_{i}" '
+            'media-type="image/jpeg"/>'
+        )
+    for i, filename in enumerate(chapter_filenames):
+        manifest.append(
+            f'<item href="{filename}" id="chapter_{i}" '
+            'media-type="application/xhtml+xml"/>'
+        )
+    manifest.append(
+        '<item href="toc.ncx" id="ncx" media-type="application/x-dtbncx+xml"/>'
+    )
+    manifest.append(
+        '<item href="nav.xhtml" id="nav" media-type="application/xhtml+xml" '
+        'properties="nav"/>'
+    )
+
+    spine = ['<itemref idref="cover"/>', '<itemref idref="nav"/>']
+    for i in range(len(chapter_filenames)):
+        spine.append(f'<itemref idref="chapter_{i}"/>')
+
+    metadata_s = "\n    ".join(metadata)
+    manifest_s = "\n    ".join(manifest)
+    spine_s = "\n    ".join(spine)
+
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" unique-identifier="id" version="3.0" \
+prefix="rendition: http://www.idpf.org/vocab/rendition/#">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/" \
+xmlns:opf="http://www.idpf.org/2007/opf">
+    {metadata_s}
+  </metadata>
+  <manifest>
+    {manifest_s}
+  </manifest>
+  <spine toc="ncx">
+    {spine_s}
+  </spine>
+</package>
+"""
+
+
+def _ncx(book_details: BookDetails, titles, chapter_filenames):
+    nav_points = []
+    for i, (title, filename) in enumerate(zip(titles, chapter_filenames)):
+        nav_points.append(
+            f'<navPoint id="chapter_{i}"><navLabel><text>{escape(title)}</text>'
+            f'</navLabel><content src="{filename}"/></navPoint>'
+        )
+    nav_points_s = "\n    ".join(nav_points)
+
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE ncx PUBLIC "-//NISO//DTD ncx 2005-1//EN" \
+"http://www.daisy.org/z3986/2005/ncx-2005-1.dtd">
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+  <head>
+    <meta content={quoteattr(book_details.identifier)} name="dtb:uid"/>
+    <meta content="0" name="dtb:depth"/>
+    <meta content="0" name="dtb:totalPageCount"/>
+    <meta content="0" name="dtb:maxPageNumber"/>
+  </head>
+  <docTitle>
+    <text>{escape(book_details.title)}</text>
+  </docTitle>
+  <navMap>
+    {nav_points_s}
+  </navMap>
+</ncx>
+"""
+
+
+def _nav(book_details: BookDetails, titles, chapter_filenames):
+    items = []
+    for title, filename in zip(titles, chapter_filenames):
+        items.append(f'<li><a href="{filename}">{escape(title)}</a></li>')
+    items_s = "\n".join(items)
+
+    body = f"""<nav epub:type="toc" id="id" role="doc-toc">
+<h2>{escape(book_details.title)}</h2>
+<ol>
+{items_s}
+</ol>
+</nav>"""
+    return _xhtml(book_details.title, body.encode("utf-8"))
+
+
+def _output_epub_ebooklib(output, book_details, style, contents, titles):
+    lang = LANG
     book = epub.EpubBook()
     book.set_identifier(book_details.identifier)
     book.set_title(book_details.title)
@@ -113,55 +440,45 @@ def output_epub(output_filepath, book_details: BookDetails, style_css_path=None)
     # TODO why not True ? check
     book.set_cover(cover_image_filename, content, False)
 
-    style = get_css(style_css_path)
-
     css = epub.EpubItem(
-        uid="style", file_name="book.css", media_type="text/css", content=style
+        uid="style",
+        file_name=STYLE_CSS_FILENAME,
+        media_type="text/css",
+        content=style,
     )
     book.add_item(css)
+    # same as add_item(css) on each document but a single list shared by all
+    css_links = [{"href": css.get_name(), "rel": "stylesheet", "type": "text/css"}]
 
     # TODO cf why not True ? above
     cover_page = epub.EpubHtml(title="Cover", file_name="cover.xhtml", lang=lang)
     cover_page.content = f'<img src="{cover_image_filename}" alt="cover" />'
-    cover_page.add_item(css)
+    cover_page.links = css_links
     book.add_item(cover_page)
 
     image: Image
-    for image in book_details.images:
+    for i, image in enumerate(book_details.images):
         # do not add if already added through cover or problems when writing:
         # "Duplicate name" warning from epublib + maybe issue in the epub zip structure
         if image.local_filename == cover_image_filename:
             continue
-        img = epub.EpubImage()
-        img.file_name = image.local_filename
-        # TODO always ? check ?
-        img.media_type = "image/jpeg"
-        img.content = image.content
+        # TODO always image/jpeg ? check ?
+        # uid set here: no need for add_item to generate one
+        img = epub.EpubImage(
+            uid=f"image_{i}",
+            file_name=image.local_filename,
+            media_type="image/jpeg",
+            content=image.content,
+        )
         book.add_item(img)
 
     chapters = []
-    new_contents, titles_list = utils.split_by_chapter(book_details.contents)
-    #print(book_details.contents)
-    with open("output.html", "w", encoding="utf-8") as file:
-        file.write(str(new_contents))
-    #titles_list = ["chap"] * 100  # Array with n elements, all initialized to 0
-    print(len(new_contents))
-    print(len(titles_list))
-
-    #print(titles_list)
-    #for i, content in enumerate(book_details.contents):
-    for i, content in enumerate(new_contents):
-
-        print(i)
-        #print(titles_list[i])
-        print("read")
+    for i, content in enumerate(contents):
         c = epub.EpubHtml(
-            title=titles_list[i], file_name=f"chap_{i}.xhtml", lang=lang
+            title=titles[i], file_name=f"chap_{i}.xhtml", lang=lang
         )
-        # explicit encoding to bytes or some issue with lxml on some platforms (PyDroid)
-        # some message about USC4 little endian not supported
-        c.content = content.encode("utf-8")
-        c.add_item(css)
+        c.content = _to_utf8(content)
+        c.links = css_links
         book.add_item(c)
         chapters.append(c)
 
@@ -173,4 +490,5 @@ def output_epub(output_filepath, book_details: BookDetails, style_css_path=None)
 
     book.spine = [cover_page, "nav", *chapters]
 
-    epub.write_epub(output_filepath, book, {})
+    # ebooklib passes output to zipfile too: path or file object
+    epub.write_epub(output, book, {})
@@ -1,3 +1,4 @@
+from functools import lru_cache
 import logging
 import re
 from urllib.parse import urlparse, urlunparse
@@ -95,6 +96,8 @@ def resource_from_url(url):
     raise BadWebURLError(f"Invalid path for URL: {url}")
 
 
+# called for each tracked series (conversion of tracked.json, sync, update...)
+@lru_cache(maxsize=4096)
 def url_from_series_slug(origin, series_slug):
     config = get_alt_config_for_origin(origin)
 
@@ -105,6 +108,7 @@ def url_from_series_slug(origin, series_slug):
     return f"{config.WEB_URL_BASE}/series/{series_slug}"
 
 
+@lru_cache(maxsize=4096)
 def to_new_website_series_url(series_url):
     # supports legacy URLs + new
     jnc_resource = resource_from_url(series_url)
@@ -1,5 +1,6 @@
-from collections import OrderedDict
+from datetime import datetime
 from functools import partial
+import hashlib
 import json
 import logging
 from pathlib import Path
@@ -8,6 +9,13 @@ from addict import Dict as Addict
 from atomicwrites import atomic_write
 import dateutil.parser
 
+try:
+    import orjson
+except ImportError:
+    # not installed on PyPy (see pyproject.toml) or no wheel for the platform
+    # (PyDroid...) => stdlib json
+    orjson = None
+
 from . import config, core, jncalts, jncweb, utils
 from .trio_utils import bag
 
@@ -32,23 +40,37 @@ class TrackConfigManager:
                 self.config_file_path = Path(config_file_path)
             # TODO check read write permission / is file etc...
 
+        # resolved once: the write replaces the target of a symlinked tracked.json
+        # instead of the link
+        self._write_file_path = str(self.config_file_path.resolve())
+        # digest of the content of the file when last read or written
+        self._file_digest = None
+
     # TODO async
     def read_tracked_series(self):
         try:
-            with self.config_file_path.open() as json_file:
-                # Explicit ordereddict (although should be fine without
-                # since Python >= 3.6 dicts are ordered ; spec since 3.7)
-                data = json.load(json_file, object_pairs_hook=OrderedDict)
-                data = Addict(data)
+            with self.config_file_path.open("rb") as json_file:
+                raw = json_file.read()
+                self._file_digest = _digest(raw)
+                data = _loads(raw)
                 return self._convert_to_latest_format(data)
         except FileNotFoundError:
             # first run ?
-            return Addict({})
+            self._file_digest = None
+            return {}
 
     def write_tracked_series(self, tracked):
+        payload = _dumps(tracked)
+        digest = _digest(payload)
+        if digest == self._file_digest:
+            # nothing changed: no need for the write (+ fsync and rename)
+            return
+
         utils.ensure_directory_exists(self.config_file_path.parent)
-        with atomic_write(str(self.config_file_path.resolve()), overwrite=True) as f:
-            f.write(json.dumps(tracked, sort_keys=True, indent=2))
+        # payload already encoded: single write of the bytes
+        with atomic_write(self._write_file_path, mode="wb", overwrite=True) as f:
+            f.write(payload)
+        self._file_digest = digest
 
     def _convert_to_latest_format(self, data):
         converted = {}
@@ -67,17 +89,38 @@ class TrackConfigManager:
                 # low effort way to get some title
                 name = series_slug.replace("-", " ").title()
                 value = Addict({"name": name, "part": value})
-                converted[series_url] = value
             else:
-                # nothing to do
-                converted[series_url_or_slug] = value
+                series_url = series_url_or_slug
+                # only the series data: the top-level is a plain dict
+                value = Addict(value)
+
+            # legacy URL => new URL
+            new_series_url = jncweb.to_new_website_series_url(series_url)
+            converted[new_series_url] = value
+
+        return converted
 
-        converted_b = {}
-        for legacy_series_url, value in converted.items():
-            new_series_url = jncweb.to_new_website_series_url(legacy_series_url)
-            converted_b[new_series_url] = value
 
-        return converted_b
+def _loads(raw):
+    # both keep the order of the keys (dicts are ordered since Python 3.7)
+    if orjson:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _dumps(tracked):
+    # bytes output in both cases
+    if orjson:
+        # Addict is a dict subclass so serialized as is
+        return orjson.dumps(tracked, option=orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2)
+    # kept indented (and not compact) since the file can be edited by hand
+    # same output as orjson
+    payload = json.dumps(tracked, sort_keys=True, indent=2, ensure_ascii=False)
+    return payload.encode("utf-8")
+
+
+def _digest(payload):
+    return hashlib.blake2b(payload, digest_size=16).digest()
 
 
 async def track_series(
@@ -120,7 +163,7 @@ async def track_series(
             )
         else:
             pn, pdate = core.last_part_number_and_date(parts)
-            part_date = dateutil.parser.parse(pdate)
+            part_date = _parse_launch_date(pdate)
             part_date_formatted = part_date.strftime("%b %d, %Y")
             # TODO display something in case last_part_number and last_part_date_raw do
             # not correspond to the same part?
@@ -154,6 +197,17 @@ async def track_series(
     )
 
 
+def _parse_launch_date(launch):
+    # format of the JNC API: 2024-01-01T10:00:00.000Z
+    # "Z" only supported by fromisoformat in Python >= 3.11
+    try:
+        return datetime.fromisoformat(launch.replace("Z", "+00:00"))
+    except ValueError:
+        # fromisoformat is stricter in Python < 3.11 (eg number of digits for
+        # the fraction of second) ; generic (slower) parser
+        return dateutil.parser.parse(launch)
+
+
 async def sync_series_forward(
     session,
     follows,
@@ -166,84 +220,116 @@ async def sync_series_forward(
     new_synced = []
     del_synced = []
 
-    async def do_track(jnc_resource):
-        series_id = await core.resolve_series(session, jnc_resource)
-        series = await core.fetch_meta(session, series_id)
-        await track_series(
-            session, tracked_series, series, is_beginning, is_first_available_volume
+    followed_index = _index_follows(follows)
+    tasks = [
+        partial(
+            _do_track,
+            session,
+            tracked_series,
+            jnc_resource,
+            new_synced,
+            is_beginning,
+            is_first_available_volume,
         )
-        # manga already excluded from follows so no need to check
-
-        series_url = jncweb.url_from_series_slug(session.origin, series.raw_data.slug)
-        new_synced.append(series_url)
-
-    tasks = []
-    for jnc_resource in follows:
-        if jnc_resource.url in tracked_series:
-            continue
-        tasks.append(partial(do_track, jnc_resource))
+        # in the order of the follows
+        for series_url, jnc_resource in followed_index.items()
+        if series_url not in tracked_series
+    ]
 
-    # result doesn't matter ; just for the exceptions
+    # result doesn't matter ; just for the exceptions (raised once all the tasks
+    # are done)
     await bag(tasks)
 
     if is_delete:
-        followed_index = {f.url: f for f in follows}
-        # list() to avoid dictionary changed size during iteration
-        for series_url, series_data in list(tracked_series.items()):
-            if series_url not in followed_index:
-                del tracked_series[series_url]
-
-                console.warning(
-                    f"The series '[highlight]{series_data.name}[/]' is no longer "
-                    "tracked"
-                )
+        # collected first to avoid dictionary changed size during iteration
+        # (list instead of set difference: keep the order of tracked.json for the
+        # messages)
+        stale_series_urls = [
+            series_url
+            for series_url in tracked_series
+            if series_url not in followed_index
+        ]
+        for series_url in stale_series_urls:
+            series_data = tracked_series.pop(series_url)
+
+            console.warning(
+                f"The series '[highlight]{series_data['name']}[/]' is no longer tracked"
+            )
 
-                del_synced.append(series_url)
+            del_synced.append(series_url)
 
     return new_synced, del_synced
 
 
+def _index_follows(follows):
+    return {f.url: f for f in follows}
+
+
+async def _do_track(
+    session,
+    tracked_series,
+    jnc_resource,
+    new_synced,
+    is_beginning,
+    is_first_available_volume,
+):
+    series_id = await core.resolve_series(session, jnc_resource)
+    series = await core.fetch_meta(session, series_id)
+    await track_series(
+        session, tracked_series, series, is_beginning, is_first_available_volume
+    )
+    # manga already excluded from follows so no need to check
+
+    series_url = jncweb.url_from_series_slug(session.origin, series.raw_data.slug)
+    new_synced.append(series_url)
+
+
 async def sync_series_backward(session, follows, tracked_series, is_delete):
     # sync remote follows based on locally tracked series
     new_synced = []
     del_synced = []
 
-    async def do_follow(jnc_resource):
-        console.info(f"Fetch metadata for '{jnc_resource}'...")
-        series_id = await core.resolve_series(session, jnc_resource)
-        series = await core.fetch_meta(session, series_id)
-        title = series.raw_data.title
-
-        console.info(f"Follow '{title}'...")
-        await session.api.follow_series(series.series_id)
-
-        new_synced.append(series_url)
-
-    followed_index = {f.url: f for f in follows}
+    followed_index = _index_follows(follows)
     tasks = []
+    # series_url is the latest URL format (same as the follows)
+    # in the order of tracked.json
     for series_url in tracked_series:
-        # series_url is the latest URL format (same as the follows)
         if series_url in followed_index:
             continue
         jnc_resource = jncweb.resource_from_url(series_url)
-        tasks.append(partial(do_follow, jnc_resource))
+        tasks.append(partial(_do_follow, session, jnc_resource, new_synced))
 
     if is_delete:
+        for series_url, jnc_resource in followed_index.items():
+            if series_url in tracked_series:
+                continue
+            tasks.append(partial(_do_unfollow, session, jnc_resource, del_synced))
 
-        async def do_undollow(jnc_resource):
-            # use the follow_raw_data: to avoid another call to the API
-            series_id = jnc_resource.follow_raw_data.id
-            title = jnc_resource.follow_raw_data.title
-            console.warning(f"Unfollow '{title}'...")
-            await session.api.unfollow_series(series_id)
+    # no result needed ; just for the exceptions (raised once all the tasks are
+    # done: a failed follow does not cancel the others)
+    await bag(tasks)
 
-            del_synced.append(jnc_resource.url)
+    return new_synced, del_synced
 
-        for jnc_resource in follows:
-            if jnc_resource.url not in tracked_series:
-                tasks.append(partial(do_undollow, jnc_resource))
 
-    # no result needed ; just for the exceptions
-    await bag(tasks)
+async def _do_follow(session, jnc_resource, new_synced):
+    console.info(f"Fetch metadata for '{jnc_resource}'...")
+    series_id = await core.resolve_series(session, jnc_resource)
+    series = await core.fetch_meta(session, series_id)
+    title = series.raw_data.title
 
-    return new_synced, del_synced
+    console.info(f"Follow '{title}'...")
+    await session.api.follow_series(series.series_id)
+
+    # same as the series URL in the tracked series
+    new_synced.append(jnc_resource.url)
+
+
+async def _do_unfollow(session, jnc_resource, del_synced):
+    # use the follow_raw_data: to avoid another call to the API
+    series_id = jnc_resource.follow_raw_data.id
+    title = jnc_resource.follow_raw_data.title
+    console.warning(f"Unfollow '{title}'...")
+    await session.api.unfollow_series(series_id)
+
+    del_synced.append(jnc_resource.url)
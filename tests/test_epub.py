@@ -0,0 +1,127 @@
+from io import BytesIO
+import zipfile
+
+from lxml import etree
+import pytest
+
+from jncep import epub
+from jncep.model import Image
+
+
+def _content(body):
+    return (
+        "<html><head><title>Part</title></head><body>"
+        f'<div class="main">{body}</div></body></html>'
+    )
+
+
+@pytest.fixture
+def book_details():
+    cover = Image("https://example.com/cover.jpg", b"cover", "cover.jpg")
+    images = [
+        Image("https://example.com/a.jpg", b"image_a", "i_a.jpg"),
+        # cover also present in the content
+        Image("https://example.com/cover.jpg", b"cover", "cover.jpg"),
+        # same content as a previous image
+        Image("https://example.com/b.jpg", b"image_a", "i_b.jpg"),
+    ]
+    contents = [
+        _content('<h1>Chapter 1</h1><p>Text<br><img src="i_a.jpg"></p>'),
+        _content(
+            '<h1>Chapter 2</h1><p>Text & more<img src="i_b.jpg">'
+            "<img src=' i_b.jpg'></p>"
+        ),
+    ]
+    return epub.BookDetails(
+        "series-slug123",
+        None,
+        "Series: Volume 1",
+        "Series_Volume_1",
+        None,
+        "Author",
+        epub.CollectionMetadata("SER-1", "Series", 1),
+        "Description",
+        ["Fantasy"],
+        cover,
+        ["Part 1"],
+        contents,
+        images,
+        False,
+    )
+
+
+@pytest.fixture
+def epub_filepath(tmp_path, monkeypatch, book_details):
+    monkeypatch.delenv(epub.EBOOKLIB_WRITER_ENVVAR, raising=False)
+    filepath = tmp_path / "book.epub"
+    epub.output_epub(str(filepath), book_details)
+    return filepath
+
+
+def test_output_epub_structure(epub_filepath):
+    with zipfile.ZipFile(epub_filepath) as zf:
+        infos = zf.infolist()
+        assert infos[0].filename == "mimetype"
+        assert infos[0].compress_type == zipfile.ZIP_STORED
+        assert zf.read("mimetype") == b"application/epub+zip"
+
+        names = zf.namelist()
+        assert len(names) == len(set(names))
+        assert "EPUB/i_a.jpg" in names
+        assert "EPUB/chap_1.xhtml" in names
+        assert zf.read("EPUB/cover.jpg") == b"cover"
+
+        assert zf.getinfo("EPUB/i_a.jpg").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("EPUB/chap_0.xhtml").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_output_epub_valid_xml(epub_filepath):
+    with zipfile.ZipFile(epub_filepath) as zf:
+        for name in zf.namelist():
+            if name.endswith((".opf", ".ncx", ".xhtml", ".xml")):
+                etree.fromstring(zf.read(name))
+
+        chapter = etree.fromstring(zf.read("EPUB/chap_0.xhtml"))
+        ns = {"x": "http://www.w3.org/1999/xhtml"}
+        assert chapter.findtext("x:head/x:title", namespaces=ns) == "Chapter 1"
+        assert chapter.find("x:body/x:p/x:img", namespaces=ns) is not None
+
+
+def test_output_epub_dedup_images(epub_filepath):
+    with zipfile.ZipFile(epub_filepath) as zf:
+        names = zf.namelist()
+        assert "EPUB/i_a.jpg" in names
+        assert "EPUB/i_b.jpg" not in names
+        assert b"i_b.jpg" not in zf.read("EPUB/content.opf")
+
+        chapter = zf.read("EPUB/chap_1.xhtml")
+        assert chapter.count(b'src="i_a.jpg"') == 2
+        assert b"i_b.jpg" not in chapter
+
+
+def test_output_epub_file_object(tmp_path, monkeypatch, book_details):
+    monkeypatch.delenv(epub.EBOOKLIB_WRITER_ENVVAR, raising=False)
+    # nothing written to disk
+    monkeypatch.chdir(tmp_path)
+    output = BytesIO()
+    epub.output_epub(output, book_details)
+    assert list(tmp_path.iterdir()) == []
+
+    with zipfile.ZipFile(output) as zf:
+        assert zf.namelist()[0] == "mimetype"
+        assert "EPUB/content.opf" in zf.namelist()
+
+
+def test_output_epub_twice(monkeypatch, book_details):
+    monkeypatch.delenv(epub.EBOOKLIB_WRITER_ENVVAR, raising=False)
+    first, second = BytesIO(), BytesIO()
+    epub.output_epub(first, book_details)
+    epub.output_epub(second, book_details)
+
+    assert book_details.images[0].content == b"image_a"
+    with zipfile.ZipFile(first) as zf1, zipfile.ZipFile(second) as zf2:
+        assert zf1.namelist() == zf2.namelist()
+        assert zf2.read("EPUB/i_a.jpg") == b"image_a"
+        # content.opf not compared: contains the modification time
+        for name in ("EPUB/chap_0.xhtml", "EPUB/chap_1.xhtml"):
+            assert zf1.read(name) == zf2.read(name)
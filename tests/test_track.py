@@ -0,0 +1,151 @@
+from datetime import datetime, timezone
+from functools import partial
+from types import SimpleNamespace
+
+from addict import Dict as Addict
+from exceptiongroup import BaseExceptionGroup
+import pytest
+import trio
+
+from jncep import track
+from jncep.jncweb import resource_from_url
+from jncep.track import (
+    TrackConfigManager,
+    _parse_launch_date,
+    sync_series_backward,
+    sync_series_forward,
+)
+
+
+def _tracked():
+    return {
+        "https://j-novel.club/series/tearmoon-empire": Addict(
+            {
+                "part_date": "2024-01-01T10:00:00.000Z",
+                "part": "1.2",
+                "name": "Tearmoon Empire",
+                "series_id": "SER-1",
+                "last_check_date": "2024-01-02T10:00:00Z",
+            }
+        )
+    }
+
+
+def test_read_missing_file(tmp_path):
+    manager = TrackConfigManager(tmp_path / "tracked.json")
+    assert len(manager.read_tracked_series()) == 0
+
+
+def test_write_read_roundtrip(tmp_path):
+    manager = TrackConfigManager(tmp_path / "tracked.json")
+    tracked = _tracked()
+    manager.write_tracked_series(tracked)
+
+    result = manager.read_tracked_series()
+    assert result == tracked
+    series_details = result["https://j-novel.club/series/tearmoon-empire"]
+    assert series_details.name == "Tearmoon Empire"
+
+
+def test_json_fallback_same_bytes(tmp_path, monkeypatch):
+    pytest.importorskip("orjson")
+    tracked = _tracked()
+    tracked["https://j-novel.club/series/tearmoon-empire"].name = "Tearmoon 帝国"
+
+    orjson_filepath = tmp_path / "tracked_orjson.json"
+    TrackConfigManager(orjson_filepath).write_tracked_series(tracked)
+
+    monkeypatch.setattr(track, "orjson", None)
+    json_filepath = tmp_path / "tracked_json.json"
+    manager = TrackConfigManager(json_filepath)
+    manager.write_tracked_series(tracked)
+
+    assert json_filepath.read_bytes() == orjson_filepath.read_bytes()
+    assert manager.read_tracked_series() == tracked
+
+
+def test_write_unchanged(tmp_path):
+    filepath = tmp_path / "tracked.json"
+    manager = TrackConfigManager(filepath)
+    manager.write_tracked_series(_tracked())
+    inode = filepath.stat().st_ino
+
+    tracked = manager.read_tracked_series()
+    manager.write_tracked_series(tracked)
+    # not replaced by the atomic write
+    assert filepath.stat().st_ino == inode
+
+    tracked["https://j-novel.club/series/tearmoon-empire"].part = "1.3"
+    manager.write_tracked_series(tracked)
+    assert filepath.stat().st_ino != inode
+    assert manager.read_tracked_series() == tracked
+
+
+def test_read_legacy_format(tmp_path):
+    filepath = tmp_path / "tracked.json"
+    filepath.write_text('{"tearmoon-empire": "1.2"}')
+
+    manager = TrackConfigManager(filepath)
+    result = manager.read_tracked_series()
+    series_details = result["https://j-novel.club/series/tearmoon-empire"]
+    assert series_details.name == "Tearmoon Empire"
+    assert series_details.part == "1.2"
+
+
+def test_sync_forward_delete():
+    tracked = _tracked()
+    tracked["https://j-novel.club/series/other"] = Addict({"name": "Other"})
+    follows = [resource_from_url("https://j-novel.club/series/tearmoon-empire")]
+
+    new_synced, del_synced = trio.run(
+        partial(sync_series_forward, None, follows, tracked, True)
+    )
+
+    assert new_synced == []
+    assert del_synced == ["https://j-novel.club/series/other"]
+    assert list(tracked) == ["https://j-novel.club/series/tearmoon-empire"]
+
+
+def test_sync_backward_run_to_completion():
+    unfollowed = []
+
+    async def unfollow_series(series_id):
+        if series_id == "SER-FAIL":
+            raise ValueError(series_id)
+        await trio.sleep(0.01)
+        unfollowed.append(series_id)
+
+    session = SimpleNamespace(api=SimpleNamespace(unfollow_series=unfollow_series))
+    follows = []
+    for slug, series_id in (("failing", "SER-FAIL"), ("other", "SER-OTHER")):
+        jnc_resource = resource_from_url(f"https://j-novel.club/series/{slug}")
+        jnc_resource.follow_raw_data = Addict({"id": series_id, "title": slug})
+        follows.append(jnc_resource)
+
+    with pytest.raises(BaseExceptionGroup) as exc_info:
+        trio.run(partial(sync_series_backward, session, follows, {}, True))
+
+    # the failure does not cancel the other unfollow
+    assert unfollowed == ["SER-OTHER"]
+    assert [str(ex) for ex in exc_info.value.exceptions] == ["SER-FAIL"]
+
+
+def test_parse_launch_date():
+    expected = datetime(2024, 1, 5, 17, 0, 0, 123000, tzinfo=timezone.utc)
+    assert _parse_launch_date("2024-01-05T17:00:00.123Z") == expected
+    assert _parse_launch_date("2024-01-05T17:00:00.12Z") == expected.replace(
+        microsecond=120000
+    )
+
+
+def test_parse_launch_date_fallback(monkeypatch):
+    class StrictDatetime(datetime):
+        @classmethod
+        def fromisoformat(cls, date_string):
+            # as in Python < 3.11 for a fraction of second that is not 3 or 6
+            # digits
+            raise ValueError(date_string)
+
+    monkeypatch.setattr(track, "datetime", StrictDatetime)
+    expected = datetime(2024, 1, 5, 17, 0, 0, 120000, tzinfo=timezone.utc)
+    assert _parse_launch_date("2024-01-05T17:00:00.12Z") == expected